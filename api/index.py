@@ -1,29 +1,112 @@
 import os
-import base64
-from typing import List, Dict, Any
+import hashlib
+import logging
+from typing import List, Dict, Any, Optional, Annotated
 
-from fastapi import FastAPI, HTTPException, Request, File, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
-from pydantic import BaseModel, validator
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, StreamingResponse, ORJSONResponse
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from pydantic import BaseModel, ConfigDict, StringConstraints, field_validator
 import asyncio
-import json
+import orjson
+import httpx
+from contextlib import asynccontextmanager
 
 from .utils.ai_client import get_next_question, generate_diagnosis
-from .utils.voice_services import speech_to_text, text_to_speech_stream, decode_base64_audio
-from .utils.doubao_streaming_asr import DoubaoStreamingASR
+from .utils.http_client import get_http_client, close_http_client
+from .utils.rate_limit import RateLimitExceeded
+# 语音相关模块（voice_services / doubao_streaming_asr）在对应端点内按需导入，
+# 只走问诊接口的冷启动不必加载 websockets 等依赖
 
 
 # 支持的模型列表
-SUPPORTED_MODELS = [
+SUPPORTED_MODELS = (
     "grok-4-1-fast-non-reasoning",
-    "doubao-seed-1-6-thinking-250715", 
-    "deepseek-v3.2-exp"
-]
+    "doubao-seed-1-6-thinking-250715",
+    "deepseek-v3.2-exp",
+)
+# 校验用的 O(1) 查找集合与预先拼好的提示文本
+_SUPPORTED_SET = frozenset(SUPPORTED_MODELS)
+_SUPPORTED_STR = ", ".join(SUPPORTED_MODELS)
+
+# UniAPI Whisper 接口的单个音频文件上限
+MAX_AUDIO_BYTES = 25 * 1024 * 1024
+# 请求体中除音频数据外的字段/边界开销余量
+_UPLOAD_OVERHEAD = 64 * 1024
+
+# 语音功能开关：ENABLE_VOICE=0 时只注册问诊/诊断接口，不挂载 STT/TTS/实时语音识别路由
+ENABLE_VOICE = os.getenv("ENABLE_VOICE", "1") == "1"
+# 豆包流式识别凭证
+DOUBAO_APP_ID = os.getenv("DOUBAO_APP_ID", "9369539387")
+DOUBAO_ACCESS_TOKEN = os.getenv("DOUBAO_ACCESS_TOKEN", "EVHujvbAnGM-OW0T3WHHO1YF8ZHRzINa")
+# 预先建立的豆包识别连接数（0 关闭连接池，每个前端连接各自建连）
+ASR_POOL_SIZE = int(os.getenv("ASR_POOL_SIZE", "0"))
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+# 首页在一次部署内不会变化：导入时读入内存并计算 ETag，请求时不再访问文件系统
+INDEX_PATH = os.path.join(BASE_DIR, "..", "public", "index.html")
+if os.path.exists(INDEX_PATH):
+    with open(INDEX_PATH, "rb") as f:
+        _INDEX_HTML = f.read()
+    # 首页会经过 GZip 中间件压缩，压缩与未压缩两种表示共用一个标签，因此使用弱 ETag
+    _INDEX_ETAG = f'W/"{hashlib.md5(_INDEX_HTML, usedforsecurity=False).hexdigest()}"'
+else:
+    _INDEX_HTML = None
+    _INDEX_ETAG = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建共享 HTTP 客户端（及可选的豆包识别连接池），关闭时释放连接"""
+    app.state.http = get_http_client()
+    app.state.asr_pool = None
+    if ENABLE_VOICE and ASR_POOL_SIZE > 0:
+        from .utils.doubao_streaming_asr import DoubaoASRPool
+        app.state.asr_pool = DoubaoASRPool(
+            DOUBAO_APP_ID, DOUBAO_ACCESS_TOKEN, size=ASR_POOL_SIZE, mode="async", sample_rate=16000
+        )
+        app.state.asr_pool.start()
+    try:
+        yield
+    finally:
+        if app.state.asr_pool is not None:
+            await app.state.asr_pool.close()
+        await close_http_client()
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """GZip 压缩中间件，跳过指定的流式接口
+
+    流式音频（PCM）几乎无法压缩，SSE 事件需要逐条尽快送达，
+    经过压缩器会被缓冲，反而推迟首包到达时间
+    """
+
+    def __init__(self, app, excluded_paths, **kwargs):
+        super().__init__(app, **kwargs)
+        self.excluded_paths = frozenset(excluded_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# 使用 orjson 序列化 JSON 响应，比标准库 json 更快
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# 压缩首页 HTML 与问诊/诊断的 JSON 响应（诊断报告含桑基图数据，体积较大）
+app.add_middleware(
+    SelectiveGZipMiddleware,
+    excluded_paths=("/api/chat/tts-stream", "/api/chat/stt-next"),
+    minimum_size=512,
+    compresslevel=5
+)
 
 # 允许跨域
 app.add_middleware(
@@ -35,71 +118,172 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    """上游限流时快速返回 503，提示客户端稍后重试"""
+    return ORJSONResponse(
+        status_code=503,
+        content={"detail": f"Service busy, please retry: {exc}"},
+        headers={"Retry-After": "1"}
+    )
+
+
+@app.exception_handler(httpx.PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: httpx.PoolTimeout):
+    """共享连接池耗尽（突发流量下等不到空闲连接）时同样快速返回 503"""
+    return ORJSONResponse(
+        status_code=503,
+        content={"detail": "Service busy, please retry: upstream connection pool exhausted"},
+        headers={"Retry-After": "1"}
+    )
+
+
 @app.get("/")
-async def serve_index():
-    """返回前端首页 public/index.html"""
-    index_path = os.path.join(BASE_DIR, "..", "public", "index.html")
-    if not os.path.exists(index_path):
+async def serve_index(request: Request):
+    """返回前端首页 public/index.html（内存缓存，支持 If-None-Match 协商缓存）"""
+    if _INDEX_HTML is None:
         raise HTTPException(status_code=404, detail="index.html not found")
-    return FileResponse(index_path)
+    
+    headers = {"ETag": _INDEX_ETAG, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == _INDEX_ETAG:
+        return Response(status_code=304, headers=headers)
+    return Response(content=_INDEX_HTML, media_type="text/html", headers=headers)
 
 
 class ChatRequest(BaseModel):
+    # 顶层多余字段直接丢弃，不做存储
+    model_config = ConfigDict(extra="ignore")
+    
     # history 中的每一项至少包含 role/content，但前端还会带上 options、selectedOptions 等字段
     # 因此前端发来的是 Dict[str, Any]，不能用 Dict[str, str] 否则会导致 422 验证失败
     history: List[Dict[str, Any]]
     model: str = "grok-4-1-fast-non-reasoning"  # 默认模型
+    # 前端开启语音播报时置为 True：/api/chat/next 返回问题的同时在后台预合成语音
+    prefetch_tts: bool = False
     
-    @validator('model')
-    def validate_model(cls, v):
-        if v not in SUPPORTED_MODELS:
-            raise ValueError(f"不支持的模型: {v}. 支持的模型: {', '.join(SUPPORTED_MODELS)}")
+    @field_validator('model')
+    @classmethod
+    def validate_model(cls, v: str) -> str:
+        if v not in _SUPPORTED_SET:
+            raise ValueError(f"不支持的模型: {v}. 支持的模型: {_SUPPORTED_STR}")
+        return v
+
+    @field_validator('history')
+    @classmethod
+    def validate_history(cls, v: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # 没有任何患者发言时大模型无从问诊，直接返回 422，省掉一次无效的上游调用
+        if not any(m.get("role") == "user" for m in v):
+            raise ValueError("history 中至少需要包含一条 user 消息")
         return v
 
 class TTSRequest(BaseModel):
-    text: str
+    model_config = ConfigDict(extra="ignore")
+    
+    # 去除首尾空白后长度须在 1-2000 之间，由 pydantic-core 在解析请求时校验，不合法直接返回 422
+    text: Annotated[str, StringConstraints(strip_whitespace=True, min_length=1, max_length=2000)]
 
 @app.post("/api/chat/next")
 async def chat_next(request: ChatRequest):
     """问诊接口"""
-    print("🔥 [FastAPI-index.py] /api/chat/next 被调用")
+    logger.debug("🔥 [FastAPI-index.py] /api/chat/next 被调用")
     result = await get_next_question(request.history, request.model)
+    question = result.get("question")
+    if ENABLE_VOICE and request.prefetch_tts and result.get("status") == "continue" \
+            and isinstance(question, str) and question.strip():
+        # 预合成只是优化，任何失败都不能影响问诊结果的返回
+        try:
+            from .utils.voice_services import prefetch_speech
+            prefetch_speech(question)
+        except Exception as e:
+            logger.warning("⚠️  [TTS] 预合成启动失败: %s", e)
     return result
 
 @app.post("/api/chat/diagnose")
 async def chat_diagnose(request: ChatRequest):
     """诊断接口"""
-    print("🔥 [FastAPI-index.py] /api/chat/diagnose 被调用")
+    logger.debug("🔥 [FastAPI-index.py] /api/chat/diagnose 被调用")
     result = await generate_diagnosis(request.history, request.model)
     return result
 
-@app.post("/api/chat/tts-stream")
-async def text_to_speech_stream_endpoint(request: TTSRequest):
-    """文本转语音 - 流式返回版本（边生成边播放）"""
-    print("🔥 [FastAPI-index.py] /api/chat/tts-stream 被调用")
+@app.post("/api/chat/combined")
+async def chat_combined(request: ChatRequest):
+    """问诊 + 诊断合并接口：两次大模型调用并发执行，只需一次往返"""
+    logger.debug("🔥 [FastAPI-index.py] /api/chat/combined 被调用")
+    next_result, diagnosis = await asyncio.gather(
+        get_next_question(request.history, request.model),
+        generate_diagnosis(request.history, request.model)
+    )
+    return {"next": next_result, "diagnosis": diagnosis}
+
+# 语音相关路由，仅在 ENABLE_VOICE 开启时挂载到 app（见文件末尾）
+voice_router = APIRouter()
+
+@voice_router.post("/api/chat/tts-stream")
+async def text_to_speech_stream_endpoint(request: TTSRequest, raw_request: Request):
+    """文本转语音 - 流式返回版本（边生成边播放）
+
+    相同文本的音频带有相同的 ETag：客户端携带 If-None-Match 时直接返回 304，
+    已缓存的音频整段返回，未缓存时流式合成
+    """
+    logger.debug("🔥 [FastAPI-index.py] /api/chat/tts-stream 被调用")
+    from .utils.voice_services import text_to_speech_stream, tts_etag, get_cached_speech, check_speech_capacity
+    
+    etag = tts_etag(request.text)
+    headers = {
+        "Content-Disposition": "inline",
+        "Cache-Control": "no-cache",
+        "ETag": etag
+    }
+    if raw_request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    cached_audio = get_cached_speech(request.text)
+    if cached_audio is not None:
+        return Response(content=cached_audio, media_type="audio/mpeg", headers=headers)
+    
+    # 合成名额不足时在响应开始前抛出 RateLimitExceeded，由异常处理器返回 503
+    check_speech_capacity(request.text)
+    
     try:
         # 返回流式音频响应
         return StreamingResponse(
             text_to_speech_stream(request.text),
             media_type="audio/mpeg",
             headers={
-                "Content-Disposition": "inline",
-                "Cache-Control": "no-cache"
+                **headers,
+                # 禁止反向代理（nginx 等）缓冲整段音频，保证首包尽快到达浏览器
+                "X-Accel-Buffering": "no"
             }
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"TTS streaming service error: {str(e)}")
 
-@app.post("/api/chat/stt")
+@voice_router.post("/api/chat/stt")
 async def speech_to_text_endpoint(request: Request):
-    """语音转文字 - 支持JSON和FormData格式"""
-    print("🔥 [FastAPI-index.py] /api/chat/stt 被调用")
+    """
+    语音转文字 - 支持JSON和FormData格式
+    
+    推荐使用 FormData 上传原始音频（或直接 POST 音频二进制到 /api/chat/stt/raw）：原始字节直接流式转发给 UniAPI，无需解码。
+    JSON（base64）格式仅为兼容无法发送 multipart 的旧客户端保留，
+    体积多出约 33% 且需要额外一次解码（使用 pybase64 SIMD 加速）。
+    """
+    logger.debug("🔥 [FastAPI-index.py] /api/chat/stt 被调用")
+    from .utils.voice_services import speech_to_text, decode_base64_audio
     try:
         content_type = request.headers.get("content-type", "")
+        is_json = "application/json" in content_type
+        
+        # 先根据 Content-Length 拒绝超大请求，避免读取/解析整个请求体
+        # （JSON 格式为 base64 编码，体积约为原始音频的 4/3）
+        max_body = (MAX_AUDIO_BYTES * 4 // 3 if is_json else MAX_AUDIO_BYTES) + _UPLOAD_OVERHEAD
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_body:
+            raise HTTPException(status_code=413, detail="Audio file too large")
         
-        if "application/json" in content_type:
-            # JSON格式（base64编码）
-            body = await request.json()
+        if is_json:
+            # JSON格式（base64编码，已不推荐）
+            logger.warning("⚠️  [STT] 收到 base64 JSON 格式音频，该格式已不推荐，请改用 FormData 上传")
+            body = orjson.loads(await request.body())
             audio_base64 = body.get("audio_data")
             mime_type = body.get("mime_type", "audio/webm")
             language = body.get("language", "zh")
@@ -107,36 +291,161 @@ async def speech_to_text_endpoint(request: Request):
             if not audio_base64:
                 raise HTTPException(status_code=400, detail="audio_data field is required")
             
+            # 解码前按 base64 长度估算原始大小，超限直接拒绝，不做无用的解码与分配
+            if len(audio_base64) * 3 // 4 > MAX_AUDIO_BYTES:
+                raise HTTPException(status_code=413, detail="Audio file too large")
+            
             audio_data = decode_base64_audio(audio_base64)
+            audio_size = len(audio_data)
             filename = "audio.webm"
         else:
             # FormData格式（原始文件上传）
-            form = await request.form()
+            # 只接受一个文件和少量字段，异常的 multipart 请求在解析阶段即返回 400
+            form = await request.form(max_files=1, max_fields=4)
             if "file" not in form:
                 raise HTTPException(status_code=400, detail="file field is required")
             
             file = form["file"]
-            audio_data = await file.read()
+            # 直接传递底层的 SpooledTemporaryFile，由 httpx 分块读取上传，不整体读入内存
+            audio_data = file.file
+            audio_size = file.size
             filename = file.filename
             mime_type = file.content_type
             language = form.get("language", "zh")
         
-        if len(audio_data) == 0:
+        if not audio_size:
             raise HTTPException(status_code=400, detail="Audio data is empty")
         
-        if "application/json" not in content_type and not mime_type.startswith('audio/'):
+        if not is_json and not mime_type.startswith('audio/'):
             raise HTTPException(status_code=400, detail="File must be an audio file")
         
         result = await speech_to_text(audio_data, filename, mime_type, language)
         return result
         
-    except HTTPException:
+    except StarletteHTTPException:
+        # 包括 request.form() 超出文件/字段数量限制时抛出的 400
         raise
+    except (httpx.PoolTimeout, RateLimitExceeded):
+        raise HTTPException(status_code=503, detail="STT service busy, please retry")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"STT service error: {str(e)}")
 
 
-@app.websocket("/api/chat/streaming-asr")
+@voice_router.post("/api/chat/stt/raw")
+async def speech_to_text_raw_endpoint(request: Request, language: str = "zh"):
+    """
+    语音转文字 - 原始音频请求体
+    
+    请求体直接是音频二进制（如前端录音得到的 Blob），Content-Type 为音频类型（如 audio/webm），
+    语言通过查询参数 ?language=zh 指定。没有 base64 编码与 multipart 解析，
+    请求体原样转发给 UniAPI。
+    """
+    logger.debug("🔥 [FastAPI-index.py] /api/chat/stt/raw 被调用")
+    from .utils.voice_services import speech_to_text
+    
+    mime_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if not mime_type.startswith("audio/"):
+        raise HTTPException(status_code=400, detail="Content-Type must be an audio type")
+    
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_AUDIO_BYTES:
+        raise HTTPException(status_code=413, detail="Audio file too large")
+    
+    audio_data = await request.body()
+    if not audio_data:
+        raise HTTPException(status_code=400, detail="Audio data is empty")
+    if len(audio_data) > MAX_AUDIO_BYTES:
+        raise HTTPException(status_code=413, detail="Audio file too large")
+    
+    # 文件名后缀取自 MIME 子类型，UniAPI 据此识别音频格式
+    filename = f"audio.{mime_type.split('/', 1)[1] or 'webm'}"
+    
+    try:
+        return await speech_to_text(audio_data, filename, mime_type, language)
+    except (httpx.PoolTimeout, RateLimitExceeded):
+        raise HTTPException(status_code=503, detail="STT service busy, please retry")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"STT service error: {str(e)}")
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """构造一条 SSE 事件"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+@voice_router.post("/api/chat/stt-next")
+async def stt_and_next_endpoint(request: Request):
+    """
+    语音问诊一体化接口 - 语音识别后直接生成下一个问题
+    
+    省去前端 STT 与 /api/chat/next 之间的一次往返。请求为 FormData：
+    file（音频）、history（JSON 字符串）、model、language。
+    以 SSE 流返回：
+    1. event: transcript  data: {"text": "..."}  识别完成立即推送
+    2. event: question    data: 与 /api/chat/next 相同的结果
+    出错时返回 event: error  data: {"message": "..."}
+    """
+    logger.debug("🔥 [FastAPI-index.py] /api/chat/stt-next 被调用")
+    from .utils.voice_services import speech_to_text
+    
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_AUDIO_BYTES + _UPLOAD_OVERHEAD:
+        raise HTTPException(status_code=413, detail="Audio file too large")
+    
+    form = await request.form(max_files=1, max_fields=4)
+    file = form.get("file")
+    if file is None or isinstance(file, str):
+        raise HTTPException(status_code=400, detail="file field is required")
+    if not file.size:
+        raise HTTPException(status_code=400, detail="Audio data is empty")
+    if not (file.content_type or "").startswith("audio/"):
+        raise HTTPException(status_code=400, detail="File must be an audio file")
+    
+    try:
+        history = orjson.loads(form.get("history") or "[]")
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="history must be a JSON array")
+    if not isinstance(history, list):
+        raise HTTPException(status_code=400, detail="history must be a JSON array")
+    
+    model = form.get("model") or ChatRequest.model_fields["model"].default
+    if model not in _SUPPORTED_SET:
+        raise HTTPException(status_code=400, detail=f"不支持的模型: {model}. 支持的模型: {_SUPPORTED_STR}")
+    language = form.get("language", "zh")
+    
+    async def event_stream():
+        try:
+            transcript = await speech_to_text(file.file, file.filename, file.content_type, language)
+        except Exception as e:
+            yield _sse_event("error", {"message": f"STT service error: {str(e)}"})
+            return
+        
+        yield _sse_event("transcript", transcript)
+        if not transcript["text"]:
+            yield _sse_event("error", {"message": "No speech recognized"})
+            return
+        
+        history.append({"role": "user", "content": transcript["text"]})
+        try:
+            result = await get_next_question(history, model)
+        except (httpx.PoolTimeout, RateLimitExceeded) as e:
+            yield _sse_event("error", {"message": f"Service busy, please retry: {e}"})
+            return
+        yield _sse_event("question", result)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _send_ws_json(websocket: WebSocket, data: Dict[str, Any]):
+    """用 orjson 序列化并以文本帧发送（绕过 Starlette send_json 的标准库 json.dumps）"""
+    await websocket.send_text(orjson.dumps(data).decode())
+
+
+@voice_router.websocket("/api/chat/streaming-asr")
 async def streaming_asr_websocket(websocket: WebSocket):
     """
     流式语音识别 WebSocket 端点（支持多轮识别）
@@ -148,63 +457,85 @@ async def streaming_asr_websocket(websocket: WebSocket):
     4. 后端返回识别结果 {"type": "partial/final", "text": "..."}
     5. 可以重复步骤1-4进行多轮识别
     """
+    from .utils.doubao_streaming_asr import DoubaoStreamingASR
+    
     await websocket.accept()
-    print("📡 [WebSocket] 客户端已连接")
+    logger.info("📡 [WebSocket] 客户端已连接")
+    
+    # 豆包客户端与前端连接同生命周期，多轮识别复用同一条上游连接；
+    # 启用连接池时租用已建好的连接，断开后归还
+    asr_pool = getattr(websocket.app.state, "asr_pool", None)
+    if asr_pool is not None:
+        client = await asr_pool.acquire()
+    else:
+        client = DoubaoStreamingASR(
+            app_id=DOUBAO_APP_ID,
+            token=DOUBAO_ACCESS_TOKEN,
+            mode="async",
+            sample_rate=16000
+        )
     
-    # 从环境变量获取豆包凭证
-    app_id = os.getenv("DOUBAO_APP_ID", "9369539387")
-    access_token = os.getenv("DOUBAO_ACCESS_TOKEN", "EVHujvbAnGM-OW0T3WHHO1YF8ZHRzINa")
+    # 每条上游连接只有一个长期运行的接收任务，跨轮次持续转发识别结果；
+    # 收到最终结果或上游断开时放入该连接对象作为本轮结束标记
+    round_end_queue: asyncio.Queue = asyncio.Queue()
+    pump_task: Optional[asyncio.Task] = None
+    pump_conn = None
+    
+    async def pump_results(conn):
+        """接收豆包识别结果并转发给前端"""
+        try:
+            while True:
+                result = await client.receive_result()
+                if result is None:
+                    break
+                
+                if result['text']:
+                    # 转发给前端
+                    await _send_ws_json(websocket, {
+                        "type": "final" if result['is_final'] else "partial",
+                        "text": result['text']
+                    })
+                    logger.debug("📤 [WebSocket] %s: %s", "最终" if result['is_final'] else "临时", result['text'])
+                
+                if result['is_final']:
+                    round_end_queue.put_nowait(conn)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("❌ [WebSocket] 接收结果错误: %s", e)
+        # 上游连接结束，唤醒可能正在等待最终结果的一轮
+        round_end_queue.put_nowait(conn)
     
     try:
         # 保持连接，支持多轮识别
         while True:
-            client = None
-            receive_task = None
+            session_started = False
+            session_finished = False
             
             try:
                 # 等待前端发送 start 命令
-                data = await websocket.receive_json()
+                data = orjson.loads(await websocket.receive_text())
                 if data.get("action") != "start":
-                    print(f"⚠️  [WebSocket] 收到非 start 命令: {data}")
+                    logger.warning("⚠️  [WebSocket] 收到非 start 命令: %s", data)
                     continue
                 
-                print("🎤 [WebSocket] 开始新一轮识别")
+                logger.debug("🎤 [WebSocket] 开始新一轮识别")
                 
-                # 初始化豆包客户端
-                client = DoubaoStreamingASR(
-                    app_id=app_id,
-                    token=access_token,
-                    mode="async",
-                    sample_rate=16000
-                )
+                # 丢弃上一轮残留的结束标记
+                while not round_end_queue.empty():
+                    round_end_queue.get_nowait()
                 
-                # 连接到豆包服务
-                await client.connect()
-                await client.send_start_request()
+                # 开始新会话（上游连接可用时直接复用，否则重连）；
+                # 初始化响应由接收任务读取，这里不等待
+                session_started = True
+                await client.start_session(wait_response=False)
                 
-                # 创建接收任务
-                async def receive_results():
-                    """接收豆包识别结果并转发给前端"""
-                    try:
-                        while True:
-                            result = await client.receive_result()
-                            if result is None:
-                                break
-                            
-                            if result['text']:
-                                # 转发给前端
-                                await websocket.send_json({
-                                    "type": "final" if result['is_final'] else "partial",
-                                    "text": result['text']
-                                })
-                                print(f"📤 [WebSocket] {'最终' if result['is_final'] else '临时'}: {result['text']}")
-                                
-                                if result['is_final']:
-                                    break
-                    except Exception as e:
-                        print(f"❌ [WebSocket] 接收结果错误: {e}")
-                
-                receive_task = asyncio.create_task(receive_results())
+                # 上游连接发生变化（首轮或重连）时为新连接启动接收任务
+                if pump_task is None or pump_task.done() or pump_conn is not client.ws:
+                    if pump_task:
+                        pump_task.cancel()
+                    pump_conn = client.ws
+                    pump_task = asyncio.create_task(pump_results(pump_conn))
                 
                 # 接收前端音频数据
                 while True:
@@ -218,45 +549,61 @@ async def streaming_asr_websocket(websocket: WebSocket):
                             
                         elif "text" in message:
                             # 控制命令
-                            data = json.loads(message["text"])
+                            data = orjson.loads(message["text"])
                             if data.get("action") == "stop":
-                                print("⏸️  [WebSocket] 收到停止命令")
+                                logger.debug("⏸️  [WebSocket] 收到停止命令")
                                 # 发送结束标记
                                 await client.send_audio_chunk(b'', is_last=True)
-                                # 等待最终结果
-                                await receive_task
+                                # 等待本轮最终结果
+                                while await round_end_queue.get() is not pump_conn:
+                                    pass
+                                session_finished = True
                                 break
                             elif data.get("action") == "start":
                                 # 新一轮识别，退出当前循环
-                                print("🔄 [WebSocket] 收到新的 start 命令，准备新一轮识别")
+                                logger.debug("🔄 [WebSocket] 收到新的 start 命令，准备新一轮识别")
                                 break
                                 
                     except WebSocketDisconnect:
-                        print("🔌 [WebSocket] 客户端断开连接")
+                        logger.info("🔌 [WebSocket] 客户端断开连接")
                         return
                     except Exception as e:
-                        print(f"❌ [WebSocket] 处理消息错误: {e}")
-                        await websocket.send_json({"type": "error", "message": str(e)})
+                        logger.error("❌ [WebSocket] 处理消息错误: %s", e)
+                        await _send_ws_json(websocket, {"type": "error", "message": str(e)})
                         break
                 
                 # 发送完成信号
-                await websocket.send_json({"type": "done"})
-                print("✅ [WebSocket] 本轮识别完成，等待下一轮...")
+                await _send_ws_json(websocket, {"type": "done"})
+                logger.debug("✅ [WebSocket] 本轮识别完成，等待下一轮...")
                 
             finally:
-                # 清理本轮资源
-                if receive_task and not receive_task.done():
-                    receive_task.cancel()
-                if client:
+                # 本轮未正常结束时上游会话状态未知，断开连接，下一轮重新建立
+                if session_started and not session_finished:
                     await client.close()
                     
     except WebSocketDisconnect:
-        print("🔌 [WebSocket] 客户端主动断开")
+        logger.info("🔌 [WebSocket] 客户端主动断开")
     except Exception as e:
-        print(f"❌ [WebSocket] 错误: {e}")
+        logger.error("❌ [WebSocket] 错误: %s", e)
         try:
-            await websocket.send_json({"type": "error", "message": str(e)})
+            await _send_ws_json(websocket, {"type": "error", "message": str(e)})
         except:
             pass
     finally:
-        print("🔌 [WebSocket] 连接已关闭")
+        if pump_task and not pump_task.done():
+            pump_task.cancel()
+            # 等接收任务退出后再归还连接，避免与下一位使用者同时读取
+            try:
+                await pump_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if asr_pool is not None:
+            # 未正常结束的一轮已在上面关闭连接，不会被放回池中
+            await asr_pool.release(client)
+        else:
+            await client.close()
+        logger.info("🔌 [WebSocket] 连接已关闭")
+
+
+if ENABLE_VOICE:
+    app.include_router(voice_router)
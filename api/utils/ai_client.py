@@ -1,93 +1,44 @@
 import os
-import json
-from typing import List, Dict, Any
+import gzip
+import asyncio
+import hashlib
+import logging
+from typing import List, Dict, Any, Callable
 
 import httpx
+import orjson
+
+from .cache import LRUCache
+from .http_client import get_http_client, HTTP_TIMEOUTS
+from .rate_limit import UNIAPI_LIMITER, RateLimitExceeded
 
 
 API_KEY = os.getenv("UNIAPI_API_KEY")
 BASE_URL = os.getenv("UNIAPI_BASE_URL", "https://hk.uniapi.io/v1").rstrip("/")
+# 接口地址与请求头在导入时拼好，每次请求直接复用
+CHAT_URL = f"{BASE_URL}/chat/completions"
+_CHAT_HEADERS = {
+    "Authorization": f"Bearer {API_KEY}",
+    "Content-Type": "application/json",
+}
 
+logger = logging.getLogger(__name__)
 
-async def _create_chat_completion(
-    *,
-    model: str,
-    messages: List[Dict[str, Any]],
-    temperature: float = 0.3,
-    max_tokens: int | None = None,
-    response_format: Dict[str, Any] | None = None,
-) -> str:
-    """调用 UniAPI(OpenAI 兼容) 的 /chat/completions 接口，返回 content 字符串。
-    支持多模态输入（文本+图片）。
-    """
-
-    if not API_KEY:
-        raise RuntimeError("UNIAPI_API_KEY is not set in environment variables")
+# 相同请求（模型 + 消息 + 参数）的回复缓存：常见开场主诉（如"头痛三天"）无需重复调用大模型
+# 只缓存解析、校验通过的结果，格式错误的回复不会被缓存，重试时重新请求大模型
+# LLM_CACHE_SIZE=0 可关闭缓存
+_RESPONSE_CACHE = LRUCache(maxsize=int(os.getenv("LLM_CACHE_SIZE", "1024")), ttl=3600)
+# 进行中的请求（缓存键 -> Future），用于合并并发的相同请求
+_INFLIGHT: Dict[str, asyncio.Future] = {}
 
-    url = f"{BASE_URL}/chat/completions"
+# 大请求体（通常是带 base64 图片的多轮历史）gzip 压缩后再上传，缩短慢速上行链路的上传时间
+# 需上游网关支持 Content-Encoding: gzip，默认关闭，设置 LLM_GZIP_REQUESTS=1 开启
+GZIP_REQUESTS = os.getenv("LLM_GZIP_REQUESTS", "0") == "1"
+GZIP_MIN_BYTES = 64 * 1024
 
-    # 处理消息，支持图片
-    processed_messages = []
-    for msg in messages:
-        if "images" in msg and msg["images"]:
-            # 构建多模态消息
-            content_parts = []
-            
-            # 添加文本部分
-            if msg.get("content"):
-                content_parts.append({
-                    "type": "text",
-                    "text": msg["content"]
-                })
-            
-            # 添加图片部分
-            for img in msg["images"]:
-                content_parts.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{img['mime_type']};base64,{img['base64']}"
-                    }
-                })
-            
-            processed_messages.append({
-                "role": msg["role"],
-                "content": content_parts
-            })
-        else:
-            # 普通文本消息
-            processed_messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
-
-    payload: Dict[str, Any] = {
-        "model": model,
-        "messages": processed_messages,
-        "temperature": temperature,
-    }
-    if max_tokens is not None:
-        payload["max_tokens"] = max_tokens
-    if response_format is not None:
-        payload["response_format"] = response_format
-
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-    }
 
-    async with httpx.AsyncClient(timeout=60.0) as client:  # 增加超时时间以处理图片
-        resp = await client.post(url, headers=headers, json=payload)
-        resp.raise_for_status()
-
-    data = resp.json()
-    # 兼容 OpenAI 风格的返回结构
-    return data["choices"][0]["message"]["content"].strip()
-
-async def get_next_question(history: List[Dict[str, Any]], model: str = "grok-4-1-fast-non-reasoning") -> Dict[str, Any]:
-    """
-    根据对话历史，决定是继续提问还是停止。
-    """
-    system_prompt = """你是一位温暖贴心的三甲医院分诊医生助手。你的任务是通过询问患者症状来收集信息，以便进行初步分诊。
+# 系统提示词及对应的 system 消息在模块加载时构建一次，每次请求直接复用（只读，不会被修改）
+_NEXT_SYSTEM_PROMPT = """你是一位温暖贴心的三甲医院分诊医生助手。你的任务是通过询问患者症状来收集信息，以便进行初步分诊。
 
 请用关怀、温暖的语气与患者交流，就像一位真正关心患者健康的医生。
 
@@ -111,46 +62,10 @@ async def get_next_question(history: List[Dict[str, Any]], model: str = "grok-4-
 
 请严格按照JSON格式输出，不要包含任何markdown标记。"""
 
-    messages = [{"role": "system", "content": system_prompt}]
-    
-    # 打印调试信息
-    print(f"📸 [AI Client] 处理历史消息，共 {len(history)} 条")
-    for i, msg in enumerate(history):
-        has_images = "images" in msg and msg.get("images")
-        print(f"  消息 {i+1}: role={msg.get('role')}, 有图片={has_images}, 图片数量={len(msg.get('images', []))}")
-        if has_images:
-            for j, img in enumerate(msg.get("images", [])):
-                print(f"    图片 {j+1}: mime_type={img.get('mime_type')}, base64长度={len(img.get('base64', ''))}")
-    
-    messages.extend(history)
-
-    try:
-        content = await _create_chat_completion(
-            model=model,
-            messages=messages,
-            temperature=0.3,
-            max_tokens=1000,
-            response_format={"type": "json_object"},
-        )
+_NEXT_SYSTEM_MSG = {"role": "system", "content": _NEXT_SYSTEM_PROMPT}
 
-        result = json.loads(content)
-        
-        if "status" in result and result["status"] == "stop":
-            return {"status": "stop"}
-        elif "question" in result:
-            return {"status": "continue", **result}
-        else:
-            return {"status": "error", "message": "Invalid response format"}
-            
-    except Exception as e:
-        print(f"Error calling AI: {e}")
-        return {"status": "error", "message": str(e)}
 
-async def generate_diagnosis(history: List[Dict[str, Any]], model: str = "grok-4-1-fast-non-reasoning") -> Dict[str, Any]:
-    """
-    根据完整对话历史生成分诊报告。
-    """
-    system_prompt = """你是一位专业的医生。根据以下的患病主诉和问诊记录（包括患者上传的图片），请生成一份结构化的分诊报告。
+_DIAG_SYSTEM_PROMPT = """你是一位专业的医生。根据以下的患病主诉和问诊记录（包括患者上传的图片），请生成一份结构化的分诊报告。
 请严格按照以下 JSON 格式输出，不要包含 Markdown 格式标记（如 ```json）：
 {
     "possible_conditions": ["疾病1", "疾病2"],
@@ -222,20 +137,212 @@ sankey_data说明：
 - 一个症状可以连接到多个分析结果，一个分析结果可以连接多个疑似疾病
 """
 
-    messages = [{"role": "system", "content": system_prompt}]
-    messages.extend(history)
+_DIAG_SYSTEM_MSG = {"role": "system", "content": _DIAG_SYSTEM_PROMPT}
+
+
+def _payload_cache_key(payload: Dict[str, Any]) -> str:
+    """对请求体做规范化（按键排序）序列化后取哈希，作为缓存键"""
+    return hashlib.blake2b(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+async def _post_chat_completion(payload: Dict[str, Any]) -> str:
+    """向上游发送 /chat/completions 请求，返回 content 字符串"""
+    headers = _CHAT_HEADERS
+
+    # 请求体用 orjson 预先序列化（含 base64 图片时体积很大），跳过 httpx 内部的标准库 json
+    body = orjson.dumps(payload)
+    if GZIP_REQUESTS and len(body) > GZIP_MIN_BYTES:
+        # 压缩数 MB 的数据耗时明显，放到线程池中执行，避免阻塞事件循环
+        body = await asyncio.to_thread(gzip.compress, body, 6)
+        headers = {**_CHAT_HEADERS, "Content-Encoding": "gzip"}
+
+    # 复用共享连接池；使用大模型的超时配置（读超时较长以处理图片）
+    # 经过 UniAPI 限流器，突发流量下超出的请求直接失败
+    async with UNIAPI_LIMITER.acquire():
+        resp = await get_http_client().post(
+            CHAT_URL,
+            headers=headers,
+            content=body,
+            timeout=HTTP_TIMEOUTS["llm"],
+        )
+    resp.raise_for_status()
+
+    data = orjson.loads(resp.content)
+    # 兼容 OpenAI 风格的返回结构
+    return data["choices"][0]["message"]["content"].strip()
+
+
+async def _create_chat_completion(
+    *,
+    model: str,
+    messages: List[Dict[str, Any]],
+    parse: Callable[[str], Any],
+    temperature: float = 0.3,
+    max_tokens: int | None = None,
+    response_format: Dict[str, Any] | None = None,
+) -> Any:
+    """调用 UniAPI(OpenAI 兼容) 的 /chat/completions 接口，返回 parse(content) 的结果。
+    支持多模态输入（文本+图片）。
+    parse 负责解析并校验回复内容，格式不符时应抛出异常；只有解析成功的结果才会写入缓存。
+    """
+
+    if not API_KEY:
+        raise RuntimeError("UNIAPI_API_KEY is not set in environment variables")
+
+    # 纯文本历史（最常见）走快速路径：只保留 role/content，无需逐条判断图片
+    has_images = any(msg.get("images") for msg in messages)
+    if not has_images:
+        processed_messages = [{"role": msg["role"], "content": msg["content"]} for msg in messages]
+    else:
+        # 处理消息，支持图片
+        processed_messages = []
+        for msg in messages:
+            if "images" in msg and msg["images"]:
+                # 构建多模态消息
+                content_parts = []
+                
+                # 添加文本部分
+                if msg.get("content"):
+                    content_parts.append({
+                        "type": "text",
+                        "text": msg["content"]
+                    })
+                
+                # 添加图片部分
+                for img in msg["images"]:
+                    content_parts.append({
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{img['mime_type']};base64,{img['base64']}"
+                        }
+                    })
+                
+                processed_messages.append({
+                    "role": msg["role"],
+                    "content": content_parts
+                })
+            else:
+                # 普通文本消息
+                processed_messages.append({
+                    "role": msg["role"],
+                    "content": msg["content"]
+                })
+
+    payload: Dict[str, Any] = {
+        "model": model,
+        "messages": processed_messages,
+        "temperature": temperature,
+    }
+    if max_tokens is not None:
+        payload["max_tokens"] = max_tokens
+    if response_format is not None:
+        payload["response_format"] = response_format
+
+    # 含图片的请求不缓存（体积大，且图片内容几乎不会重复）
+    if has_images:
+        return parse(await _post_chat_completion(payload))
+
+    cache_key = _payload_cache_key(payload)
+    cached = _RESPONSE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # 相同请求正在进行中（如多个用户同时发送相同的开场主诉）：等待其结果，不重复调用上游
+    # shield 保证某个等待方被取消时不会连带取消共享的请求
+    inflight = _INFLIGHT.get(cache_key)
+    if inflight is not None:
+        return await asyncio.shield(inflight)
+
+    future = asyncio.get_running_loop().create_future()
+    _INFLIGHT[cache_key] = future
+    try:
+        result = parse(await _post_chat_completion(payload))
+    except asyncio.CancelledError:
+        future.set_exception(RuntimeError("Coalesced LLM request was cancelled"))
+        future.exception()  # 标记异常已读取，没有等待方时不会产生告警
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()
+        raise
+    else:
+        _RESPONSE_CACHE.set(cache_key, result)
+        future.set_result(result)
+        return result
+    finally:
+        del _INFLIGHT[cache_key]
+
+def _parse_next_question(content: str) -> Dict[str, Any]:
+    """解析问诊回复，格式不符时抛出 ValueError"""
+    result = orjson.loads(content)
+    if not isinstance(result, dict):
+        raise ValueError("Invalid response format")
+    if result.get("status") == "stop":
+        return {"status": "stop"}
+    if "question" in result:
+        return {"status": "continue", **result}
+    raise ValueError("Invalid response format")
+
+
+def _parse_diagnosis(content: str) -> Dict[str, Any]:
+    """解析诊断报告，不是 JSON 对象时抛出 ValueError"""
+    result = orjson.loads(content)
+    if not isinstance(result, dict):
+        raise ValueError("Invalid response format")
+    return result
+
+
+async def get_next_question(history: List[Dict[str, Any]], model: str = "grok-4-1-fast-non-reasoning") -> Dict[str, Any]:
+    """
+    根据对话历史，决定是继续提问还是停止。
+    """
+    messages = [_NEXT_SYSTEM_MSG, *history]
+
+    # 调试信息（仅在 DEBUG 级别下遍历历史，生产环境零开销）
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📸 [AI Client] 处理历史消息，共 %d 条", len(history))
+        for i, msg in enumerate(history):
+            has_images = "images" in msg and msg.get("images")
+            logger.debug("  消息 %d: role=%s, 有图片=%s, 图片数量=%d", i + 1, msg.get('role'), bool(has_images), len(msg.get('images', [])))
+            if has_images:
+                for j, img in enumerate(msg.get("images", [])):
+                    logger.debug("    图片 %d: mime_type=%s, base64长度=%d", j + 1, img.get('mime_type'), len(img.get('base64', '')))
 
     try:
-        content = await _create_chat_completion(
+        return await _create_chat_completion(
             model=model,
             messages=messages,
+            parse=_parse_next_question,
             temperature=0.3,
+            max_tokens=1000,
             response_format={"type": "json_object"},
         )
+            
+    except (httpx.PoolTimeout, RateLimitExceeded):
+        # 限流或连接池耗尽交给端点返回 503
+        raise
+    except Exception as e:
+        logger.error("Error calling AI: %s", e)
+        return {"status": "error", "message": str(e)}
 
-        return json.loads(content)
+async def generate_diagnosis(history: List[Dict[str, Any]], model: str = "grok-4-1-fast-non-reasoning") -> Dict[str, Any]:
+    """
+    根据完整对话历史生成分诊报告。
+    """
+    messages = [_DIAG_SYSTEM_MSG, *history]
+
+    try:
+        return await _create_chat_completion(
+            model=model,
+            messages=messages,
+            parse=_parse_diagnosis,
+            temperature=0.3,
+            response_format={"type": "json_object"},
+        )
+    except (httpx.PoolTimeout, RateLimitExceeded):
+        raise
     except Exception as e:
-        print(f"Error generating diagnosis: {e}")
+        logger.error("Error generating diagnosis: %s", e)
         return {
             "possible_conditions": ["生成失败"],
             "department": "未知",
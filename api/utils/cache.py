@@ -0,0 +1,64 @@
+"""
+进程内 LRU 缓存
+在 Vercel / 本地的热实例内复用上游结果（大模型回复、TTS 音频等），冷启动后自然失效
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """简单的 LRU 缓存，支持可选的过期时间（秒）与总字节数上限"""
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            maxsize: 最大条目数，<= 0 表示禁用缓存
+            ttl: 过期时间（秒），None 表示永不过期
+            max_bytes: 所有值的总长度上限（按 len(value) 计，适用于 bytes 值），None 表示不限制
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """读取缓存，命中时刷新为最近使用"""
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._pop(key)
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if self.maxsize <= 0:
+            return
+        if self.max_bytes is not None and len(value) > self.max_bytes:
+            return
+
+        if key in self._data:
+            self._pop(key)
+
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (value, expires_at)
+        if self.max_bytes is not None:
+            self._bytes += len(value)
+
+        while len(self._data) > self.maxsize or (self.max_bytes is not None and self._bytes > self.max_bytes):
+            self._pop(next(iter(self._data)))
+
+    def _pop(self, key: Hashable):
+        value, _ = self._data.pop(key)
+        if self.max_bytes is not None:
+            self._bytes -= len(value)
+
+    def __len__(self) -> int:
+        return len(self._data)
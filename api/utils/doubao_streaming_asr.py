@@ -4,13 +4,47 @@
 """
 import asyncio
 import websockets
-import json
+import orjson
 import gzip
+import zlib
 import struct
 import os
+import uuid
+import time
+import logging
+from collections import deque
+from websockets.protocol import State
 from typing import AsyncGenerator, Callable, Optional
 
 
+logger = logging.getLogger(__name__)
+
+# 预编译的二进制协议结构，避免每帧重新解析格式串
+# 大端 4 字节无符号整数（payload size）
+_UINT32 = struct.Struct('>I')
+# 4 字节消息头
+_HEADER = struct.Struct('BBBB')
+# 响应头：header(4B) + sequence(4B) + payload_size(4B)
+_RESP_HDR = struct.Struct('>BBBBII')
+# 消息头第一个字节固定为 version(0001) + header_size(0001)
+_HEADER_BYTE1 = (0b0001 << 4) | 0b0001
+# 超过该大小的响应帧（长句的完整识别结果）放到线程中解压与解析，避免阻塞事件循环；
+# 小帧线程切换的开销大于解析本身，仍在事件循环中直接处理
+_OFFLOAD_THRESHOLD = 8 * 1024
+# 空内容的 gzip 数据长度（10B 头 + 2B 空 deflate 块 + 8B 尾），不超过该长度的压缩 payload 必为空
+_EMPTY_GZIP_SIZE = 20
+
+# Gzip 压缩器模板（wbits=31 输出 gzip 格式）：每次复制一份使用，
+# 省去 gzip.compress 每次新建压缩器与写文件头的开销；发送的数据量小，使用最快的压缩级别
+_GZIP_TEMPLATE = zlib.compressobj(1, zlib.DEFLATED, 31)
+
+
+def _gzip_compress(data: bytes) -> bytes:
+    """Gzip 压缩一条消息的 payload"""
+    compressor = _GZIP_TEMPLATE.copy()
+    return compressor.compress(data) + compressor.flush()
+
+
 class DoubaoStreamingASR:
     """豆包流式语音识别客户端"""
     
@@ -27,7 +61,8 @@ class DoubaoStreamingASR:
         sample_rate: int = 16000,
         format: str = "pcm",
         bits_per_sample: int = 16,
-        channel: int = 1
+        channel: int = 1,
+        compress_audio: bool = False
     ):
         """
         初始化流式识别客户端
@@ -40,6 +75,8 @@ class DoubaoStreamingASR:
             format: 音频格式，支持 pcm/ogg_opus/opus/mp3/flac/aac/amr/speex
             bits_per_sample: 采样位数，仅 PCM 格式需要
             channel: 声道数，1=单声道
+            compress_audio: 是否对音频包做 Gzip 压缩。PCM 几乎无法压缩，默认直接发送原始数据，
+                省去每包一次的压缩开销
         """
         self.app_id = app_id
         self.token = token
@@ -47,6 +84,7 @@ class DoubaoStreamingASR:
         self.format = format
         self.bits_per_sample = bits_per_sample
         self.channel = channel
+        self.compress_audio = compress_audio
         
         # 选择接口地址
         if mode == "async":
@@ -58,6 +96,29 @@ class DoubaoStreamingASR:
             
         self.ws = None
         self.sequence = 0
+        # 本轮最近一次返回的中间结果文本，用于跳过重复的中间结果
+        self._last_text = ""
+        
+        # 音频包的消息头只有"普通包 / 最后一包"两种，预先生成，发送时直接拼接
+        audio_compression = 0b0001 if compress_audio else 0b0000  # Gzip / 不压缩
+        self._audio_header = self._create_header(
+            message_type=0b0010,  # Audio only client request
+            message_flags=0b0000,
+            serialization=0b0000,  # None (raw bytes)
+            compression=audio_compression
+        )
+        self._audio_header_last = self._create_header(
+            message_type=0b0010,
+            message_flags=0b0010,  # 最后一包标志
+            serialization=0b0000,
+            compression=audio_compression
+        )
+        
+        # 初始化请求的内容只取决于构造参数（每轮会话开始时 sequence 均为 0），
+        # 预先序列化并压缩，每轮识别直接发送
+        self._start_message = self._pack_full_request(self._build_start_request(0))
+        # 结束识别的空音频尾包同样固定不变
+        self._last_frame = self._pack_audio_request(b'', is_last=True)
     
     def _create_header(
         self, 
@@ -78,12 +139,10 @@ class DoubaoStreamingASR:
         - compression (4 bits): 压缩方法
         - reserved (8 bits): 保留字段
         """
-        byte1 = (0b0001 << 4) | 0b0001  # version + header_size
         byte2 = (message_type << 4) | message_flags
         byte3 = (serialization << 4) | compression
-        byte4 = 0x00  # reserved
         
-        return struct.pack('BBBB', byte1, byte2, byte3, byte4)
+        return _HEADER.pack(_HEADER_BYTE1, byte2, byte3, 0x00)  # 最后一字节为保留字段
     
     def _pack_full_request(self, request_data: dict) -> bytes:
         """
@@ -91,11 +150,11 @@ class DoubaoStreamingASR:
         
         消息类型：0001 (Full client request)
         """
-        # 序列化为 JSON
-        json_data = json.dumps(request_data, ensure_ascii=False).encode('utf-8')
+        # 序列化为 JSON（orjson 直接输出 UTF-8 字节）
+        json_data = orjson.dumps(request_data)
         
         # Gzip 压缩
-        compressed_data = gzip.compress(json_data)
+        compressed_data = _gzip_compress(json_data)
         
         # 创建消息头
         header = self._create_header(
@@ -106,9 +165,9 @@ class DoubaoStreamingASR:
         )
         
         # 打包：header + payload_size + payload
-        payload_size = struct.pack('>I', len(compressed_data))  # 大端
+        payload_size = _UINT32.pack(len(compressed_data))  # 大端
         
-        return header + payload_size + compressed_data
+        return b"".join((header, payload_size, compressed_data))
     
     def _pack_audio_request(self, audio_data: bytes, is_last: bool = False) -> bytes:
         """
@@ -116,22 +175,15 @@ class DoubaoStreamingASR:
         
         消息类型：0010 (Audio only client request)
         """
-        # Gzip 压缩音频
-        compressed_audio = gzip.compress(audio_data)
+        # 按配置决定是否 Gzip 压缩音频（默认发送原始 PCM）
+        if self.compress_audio:
+            audio_data = _gzip_compress(audio_data)
         
-        # 创建消息头
-        message_flags = 0b0010 if is_last else 0b0000  # 最后一包标志
-        header = self._create_header(
-            message_type=0b0010,  # Audio only client request
-            message_flags=message_flags,
-            serialization=0b0000,  # None (raw bytes)
-            compression=0b0001     # Gzip
-        )
+        # 使用预先生成的消息头
+        header = self._audio_header_last if is_last else self._audio_header
         
-        # 打包：header + payload_size + payload
-        payload_size = struct.pack('>I', len(compressed_audio))
-        
-        return header + payload_size + compressed_audio
+        # 打包：header + payload_size + payload（join 一次分配完整帧，避免 + 拼接产生中间对象）
+        return b"".join((header, _UINT32.pack(len(audio_data)), audio_data))
     
     def _unpack_response(self, data: bytes) -> dict:
         """
@@ -142,53 +194,42 @@ class DoubaoStreamingASR:
         if len(data) < 12:
             raise ValueError("响应数据太短")
         
-        # 解析头部
-        header = data[0:4]
-        byte2 = header[1]
-        message_type = (byte2 >> 4) & 0x0F
+        # 一次解析头部、sequence 与 payload size
+        _, byte2, byte3, _, sequence, payload_size = _RESP_HDR.unpack_from(data, 0)
         message_flags = byte2 & 0x0F
-        
-        byte3 = header[2]
         serialization = (byte3 >> 4) & 0x0F
         compression = byte3 & 0x0F
         
-        # 解析 sequence
-        sequence = struct.unpack('>I', data[4:8])[0]
-        
-        # 解析 payload size
-        payload_size = struct.unpack('>I', data[8:12])[0]
-        
-        # 解析 payload
-        payload = data[12:12+payload_size]
-        
-        # 如果 payload 为空，返回空结果
-        if payload_size == 0 or len(payload) == 0:
+        # 如果 payload 为空（包括只有空 gzip 数据的确认帧），返回空结果，不必解压
+        if payload_size == 0 or len(data) <= 12 or (compression == 0b0001 and payload_size <= _EMPTY_GZIP_SIZE):
             return {
                 "sequence": sequence,
                 "is_last": (message_flags & 0b0011) == 0b0011,
                 "data": {}
             }
         
-        # 解压缩
+        # 解压缩（压缩数据通过 memoryview 直接交给 gzip，不额外复制一份 payload）
         if compression == 0b0001:  # Gzip
             try:
-                payload = gzip.decompress(payload)
+                payload = gzip.decompress(memoryview(data)[12:12+payload_size])
             except Exception as e:
-                print(f"⚠️  Gzip 解压失败: {e}")
+                logger.warning("⚠️  Gzip 解压失败: %s", e)
                 return {
                     "sequence": sequence,
                     "is_last": (message_flags & 0b0011) == 0b0011,
                     "data": {"error": "decompress_failed"}
                 }
+        else:
+            payload = data[12:12+payload_size]
         
         # 反序列化
         if serialization == 0b0001:  # JSON
             try:
-                decoded = payload.decode('utf-8')
-                result = json.loads(decoded)
+                # orjson 直接解析 UTF-8 字节，无需先解码为 str
+                result = orjson.loads(payload)
             except Exception as e:
-                print(f"⚠️  JSON 解析失败: {e}")
-                print(f"   Payload 前100字节: {payload[:100]}")
+                logger.warning("⚠️  JSON 解析失败: %s", e)
+                logger.debug("   Payload 前100字节: %r", payload[:100])
                 return {
                     "sequence": sequence,
                     "is_last": (message_flags & 0b0011) == 0b0011,
@@ -208,8 +249,6 @@ class DoubaoStreamingASR:
     
     async def connect(self):
         """建立 WebSocket 连接"""
-        import uuid
-        
         # 生成唯一的连接 ID
         connect_id = str(uuid.uuid4())
         
@@ -223,7 +262,7 @@ class DoubaoStreamingASR:
         ]
         
         # 简化输出
-        print(f"📡 正在连接豆包服务 (豆包2.0 双向流式优化版)...")
+        logger.info("📡 正在连接豆包服务 (豆包2.0 双向流式优化版)...")
         
         # websockets 14.0+ 使用 additional_headers
         self.ws = await websockets.connect(
@@ -231,10 +270,38 @@ class DoubaoStreamingASR:
             additional_headers=headers
         )
         
-        print(f"✅ 已连接到豆包流式识别服务")
+        logger.info("✅ 已连接到豆包流式识别服务")
     
-    async def send_start_request(self):
-        """发送初始化请求"""
+    @property
+    def is_connected(self) -> bool:
+        """上游 WebSocket 连接是否可用"""
+        return self.ws is not None and self.ws.state is State.OPEN
+    
+    async def start_session(self, wait_response: bool = True):
+        """
+        开始新一轮识别会话（复用已有连接）
+        
+        连接仍然可用时只发送新的初始化请求，省去 TLS + WebSocket 握手；
+        若上游已断开（例如服务端在上一轮结束后关闭连接）则自动重连。
+        
+        Args:
+            wait_response: 是否在此等待初始化响应；已有任务持续调用 receive_result 时
+                应设为 False，初始化响应会作为一条空结果由该任务读到
+        """
+        self.sequence = 0
+        if not self.is_connected:
+            await self.connect()
+            return await self.send_start_request(wait_response)
+        
+        try:
+            return await self.send_start_request(wait_response)
+        except websockets.exceptions.ConnectionClosed:
+            logger.warning("⚠️ 上游连接已失效，重新连接")
+            await self.connect()
+            return await self.send_start_request(wait_response)
+    
+    def _build_start_request(self, sequence: int) -> dict:
+        """构造初始化请求内容"""
         request_data = {
             "app": {
                 "appid": self.app_id,
@@ -250,7 +317,7 @@ class DoubaoStreamingASR:
                 "channel": self.channel,
             },
             "request": {
-                "reqid": f"req_{self.sequence}",
+                "reqid": f"req_{sequence}",
                 "nbest": 1,
                 "show_language": False,
                 "show_utterances": True,
@@ -262,16 +329,28 @@ class DoubaoStreamingASR:
         if self.format == "pcm":
             request_data["audio"]["bits"] = self.bits_per_sample
         
-        message = self._pack_full_request(request_data)
+        return request_data
+    
+    async def send_start_request(self, wait_response: bool = True):
+        """发送初始化请求"""
+        self._last_text = ""
+        if self.sequence == 0:
+            message = self._start_message
+        else:
+            message = self._pack_full_request(self._build_start_request(self.sequence))
+        
         await self.ws.send(message)
         
+        if not wait_response:
+            return None
+        
         # 等待服务器响应
         response_data = await self.ws.recv()
         response = self._unpack_response(response_data)
         
         # 检查初始化是否成功
         if response['data']:
-            print(f"✅ 初始化成功，准备接收音频")
+            logger.debug("✅ 初始化成功，准备接收音频")
         
         return response
     
@@ -283,41 +362,72 @@ class DoubaoStreamingASR:
             audio_data: 音频数据（建议 100-200ms）
             is_last: 是否是最后一包
         """
-        message = self._pack_audio_request(audio_data, is_last)
+        if is_last and not audio_data:
+            message = self._last_frame
+        else:
+            message = self._pack_audio_request(audio_data, is_last)
         await self.ws.send(message)
         self.sequence += 1
     
+    def _parse_result(self, response_data: bytes) -> dict:
+        """
+        解析一条服务器响应为识别结果
+        
+        Returns:
+            识别结果字典，包含 text, is_final 等字段
+        """
+        response = self._unpack_response(response_data)
+        
+        result_data = response['data']
+        
+        # 提取识别文本
+        text = ""
+        is_final = response['is_last']
+        
+        if 'result' in result_data:
+            utterances = result_data['result'].get('utterances', [])
+            if utterances:
+                text = utterances[0].get('text', '')
+        
+        return {
+            "text": text,
+            "is_final": is_final,
+            "sequence": response['sequence'],
+            "raw": result_data
+        }
+    
+    async def _parse_result_async(self, response_data: bytes) -> dict:
+        """解析识别结果，大帧放到线程中执行"""
+        if len(response_data) > _OFFLOAD_THRESHOLD:
+            return await asyncio.to_thread(self._parse_result, response_data)
+        return self._parse_result(response_data)
+    
     async def receive_result(self) -> Optional[dict]:
         """
         接收识别结果
         
+        豆包会连续推送大量文本相同的中间结果，这类重复结果直接跳过，继续等待下一条
+        
         Returns:
             识别结果字典，包含 text, is_final 等字段
         """
         try:
-            response_data = await self.ws.recv()
-            response = self._unpack_response(response_data)
-            
-            result_data = response['data']
-            
-            # 提取识别文本
-            text = ""
-            is_final = response['is_last']
-            
-            if 'result' in result_data:
-                utterances = result_data['result'].get('utterances', [])
-                if utterances:
-                    text = utterances[0].get('text', '')
-            
-            return {
-                "text": text,
-                "is_final": is_final,
-                "sequence": response['sequence'],
-                "raw": result_data
-            }
+            while True:
+                response_data = await self.ws.recv()
+                result = await self._parse_result_async(response_data)
+                
+                text = result['text']
+                if result['is_final']:
+                    self._last_text = ""
+                    return result
+                if text and text == self._last_text:
+                    continue
+                if text:
+                    self._last_text = text
+                return result
             
         except websockets.exceptions.ConnectionClosed:
-            print("⚠️ WebSocket 连接已关闭")
+            logger.info("⚠️ WebSocket 连接已关闭")
             return None
     
     async def close(self):
@@ -326,6 +436,145 @@ class DoubaoStreamingASR:
             await self.ws.close()
 
 
+class DoubaoASRPool:
+    """
+    预先建立好的豆包识别连接池
+    
+    前端 WebSocket 连接打开时直接租用一条已完成 TLS + WebSocket 握手与鉴权的上游连接，
+    识别结束后归还，省去每次建连的往返。池中没有可用连接时退回到新建客户端（首轮识别时再连接）。
+    空闲连接 + 租出的连接 + 正在建立的连接总数不超过 size：正常归还的连接直接放回复用，
+    只有租出的连接被丢弃（未正常结束而关闭）时才补建；后台任务定期替换即将过期的空闲连接。
+    """
+    
+    def __init__(self, app_id: str, token: str, size: int = 2, max_idle: float = 30.0, **client_kwargs):
+        """
+        Args:
+            app_id: APP ID
+            token: Token
+            size: 池管理的连接总数（含租出的连接）
+            max_idle: 空闲连接的最长保留时间（秒），超时的连接可能已被服务端关闭，由后台任务提前替换
+            client_kwargs: 传给 DoubaoStreamingASR 的其余参数（mode、sample_rate 等）
+        """
+        self.app_id = app_id
+        self.token = token
+        self.size = size
+        self.max_idle = max_idle
+        # 后台检查间隔：空闲时间在下次检查前就会超过 max_idle 的连接，本次检查即替换
+        self.refresh_interval = max_idle / 3
+        self.client_kwargs = client_kwargs
+        # 空闲连接：(客户端, 放入时间)
+        self._idle: deque = deque()
+        # 计入池容量的租出客户端（池满时临时新建的客户端不计入，归还时有空位才留下）
+        self._leased = set()
+        self._connecting = 0
+        self._tasks = set()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._closed = False
+    
+    def _new_client(self) -> DoubaoStreamingASR:
+        return DoubaoStreamingASR(self.app_id, self.token, **self.client_kwargs)
+    
+    def _available_slots(self) -> int:
+        return self.size - len(self._idle) - len(self._leased) - self._connecting
+    
+    async def _connect_one(self):
+        client = self._new_client()
+        try:
+            await client.connect()
+        except Exception as e:
+            logger.warning("⚠️ 预建豆包连接失败: %s", e)
+            return
+        finally:
+            self._connecting -= 1
+        if self._closed or self._available_slots() <= 0:
+            await client.close()
+        else:
+            self._idle.append((client, time.monotonic()))
+    
+    def fill(self):
+        """在后台补足连接（不阻塞调用方）"""
+        if self._closed:
+            return
+        for _ in range(self._available_slots()):
+            self._connecting += 1
+            task = asyncio.create_task(self._connect_one())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    def start(self):
+        """预建连接并启动后台刷新任务（应用启动时调用）"""
+        self.fill()
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+    
+    async def _refresh_loop(self):
+        """定期关闭已断开或即将过期的空闲连接并补建，租用时拿到的总是可用的连接"""
+        while not self._closed:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                # 先同步地把过期连接移出空闲队列再逐个关闭：关闭期间 acquire() 可能并发取走连接，
+                # 不能在 await 之间对队列做 remove
+                deadline = time.monotonic() - (self.max_idle - self.refresh_interval)
+                expired = []
+                fresh = deque()
+                for item in self._idle:
+                    if not item[0].is_connected or item[1] <= deadline:
+                        expired.append(item[0])
+                    else:
+                        fresh.append(item)
+                self._idle = fresh
+                if expired:
+                    self.fill()
+                for client in expired:
+                    try:
+                        await client.close()
+                    except Exception as e:
+                        logger.warning("⚠️ 关闭过期的豆包连接失败: %s", e)
+            except Exception as e:
+                logger.error("❌ 豆包连接池刷新失败: %s", e)
+    
+    async def acquire(self) -> DoubaoStreamingASR:
+        """租用一条空闲连接，没有可用连接时返回新的（未连接的）客户端"""
+        now = time.monotonic()
+        client = None
+        discarded = False
+        while self._idle:
+            candidate, idle_since = self._idle.popleft()
+            if candidate.is_connected and now - idle_since < self.max_idle:
+                client = candidate
+                break
+            discarded = True
+            await candidate.close()
+        if client is None:
+            client = self._new_client()
+            if self._available_slots() <= 0:
+                return client
+        self._leased.add(client)
+        if discarded:
+            self.fill()
+        return client
+    
+    async def release(self, client: DoubaoStreamingASR):
+        """归还连接：仍然可用时放回池中；已断开或池已满时关闭，并补建被丢弃的连接"""
+        self._leased.discard(client)
+        if not self._closed and client.is_connected and self._available_slots() > 0:
+            self._idle.append((client, time.monotonic()))
+            return
+        await client.close()
+        self.fill()
+    
+    async def close(self):
+        """关闭池中所有连接（应用关闭时调用）"""
+        self._closed = True
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        while self._idle:
+            client, _ = self._idle.popleft()
+            await client.close()
+
+
 async def streaming_recognize(
     audio_generator: AsyncGenerator[bytes, None],
     app_id: str,
@@ -355,37 +604,84 @@ async def streaming_recognize(
         # 发送初始化请求
         await client.send_start_request()
         
-        # 创建接收任务
+        # 接收与处理解耦：recv_loop 尽快读取原始帧放入有界队列，
+        # receive_loop 按批取出解析，一批中的多个中间结果只回调最后一条
+        frames: asyncio.Queue = asyncio.Queue(maxsize=256)
+        # recv_loop 遇到的异常，由 receive_loop 读到结束标记后抛给调用方
+        recv_errors: list = []
+        
+        async def recv_loop():
+            try:
+                while True:
+                    await frames.put(await client.ws.recv())
+            except websockets.exceptions.ConnectionClosed:
+                logger.info("⚠️ WebSocket 连接已关闭")
+            except Exception as e:
+                recv_errors.append(e)
+            finally:
+                # 无论以何种方式退出都放入结束标记，避免 receive_loop 永远等待；
+                # 不在此处等待队列空位（被取消时不能阻塞）。队列已满时放弃，
+                # receive_loop 读空队列后发现本任务已结束，同样按结束处理
+                try:
+                    frames.put_nowait(None)
+                except asyncio.QueueFull:
+                    pass
+        
         async def receive_loop():
             final_text = ""
+            last_partial = ""
             while True:
-                result = await client.receive_result()
-                if result is None:
-                    break
+                if frames.empty() and recv_task.done():
+                    batch = [None]  # 结束标记因队列已满未能放入
+                else:
+                    batch = [await frames.get()]
+                while not frames.empty() and len(batch) < 64:
+                    batch.append(frames.get_nowait())
                 
-                if result['text']:
-                    on_result(result['text'], result['is_final'])
+                partial_text = ""
+                for response_data in batch:
+                    if response_data is None:
+                        if recv_errors:
+                            raise recv_errors[0]
+                        if partial_text and partial_text != last_partial:
+                            on_result(partial_text, False)
+                        return final_text
+                    
+                    result = await client._parse_result_async(response_data)
                     if result['is_final']:
-                        final_text = result['text']
+                        # 最终结果覆盖本批中尚未回调的中间结果
+                        if result['text']:
+                            final_text = result['text']
+                            on_result(final_text, True)
+                        return final_text
+                    
+                    if result['text']:
+                        partial_text = result['text']
                 
-                if result['is_final']:
-                    break
-            
-            return final_text
+                # 与上次回调的中间结果相同则跳过
+                if partial_text and partial_text != last_partial:
+                    on_result(partial_text, False)
+                    last_partial = partial_text
         
+        recv_task = asyncio.create_task(recv_loop())
         receive_task = asyncio.create_task(receive_loop())
         
-        # 发送音频数据
-        async for audio_chunk in audio_generator:
-            await client.send_audio_chunk(audio_chunk, is_last=False)
-        
-        # 发送最后一包（空数据）
-        await client.send_audio_chunk(b'', is_last=True)
-        
-        # 等待接收完成
-        final_text = await receive_task
-        
-        return final_text
+        try:
+            # 发送音频数据
+            async for audio_chunk in audio_generator:
+                await client.send_audio_chunk(audio_chunk, is_last=False)
+            
+            # 发送最后一包（空数据）
+            await client.send_audio_chunk(b'', is_last=True)
+            
+            # 等待接收完成
+            return await receive_task
+        finally:
+            # 发送中途出错时两个任务都还在运行：取消并等待退出，
+            # 同时取走它们的异常，避免任务被遗弃或产生未读取异常的告警
+            recv_task.cancel()
+            receive_task.cancel()
+            await asyncio.gather(recv_task, receive_task, return_exceptions=True)
         
     finally:
         await client.close()
@@ -5,9 +5,28 @@
 """
 
 import httpx
-import json
-import base64
-from typing import AsyncGenerator, Optional
+import orjson
+import pybase64
+from typing import AsyncGenerator, Optional, Union
+
+from .http_client import get_http_client
+
+
+async def _aiter_jsonl(response: httpx.Response) -> AsyncGenerator[bytes, None]:
+    """按换行切分流式响应体（JSONL），直接产出 bytes 行，不做整体的 str 解码"""
+    buffer = bytearray()
+    async for chunk in response.aiter_bytes():
+        buffer += chunk
+        start = 0
+        while (end := buffer.find(b"\n", start)) != -1:
+            if end > start:
+                yield bytes(buffer[start:end])
+            start = end + 1
+        if start:
+            del buffer[:start]
+    
+    if buffer:
+        yield bytes(buffer)
 
 
 class DoubaoStreamingTTS:
@@ -21,7 +40,8 @@ class DoubaoStreamingTTS:
         speaker: str = "zh_female_tianxinxiaomei_emo_v2_mars_bigtts",
         sample_rate: int = 24000,
         audio_format: str = "pcm",  # 改为pcm支持真正的流式播放
-        timeout: float = 30.0
+        timeout: Union[float, httpx.Timeout] = 30.0,
+        min_chunk_size: int = 4096
     ):
         """
         初始化豆包TTS客户端
@@ -33,7 +53,9 @@ class DoubaoStreamingTTS:
             speaker: 说话人
             sample_rate: 采样率
             audio_format: 音频格式 (pcm/mp3)，pcm支持真正的流式播放
-            timeout: 超时时间
+            timeout: 超时时间（秒，或 httpx.Timeout）
+            min_chunk_size: 向下游输出的最小音频块大小（字节），
+                上游的小块音频合并后再输出，减少下游的分块发送次数
         """
         self.app_id = app_id
         self.access_key = access_key
@@ -42,7 +64,15 @@ class DoubaoStreamingTTS:
         self.sample_rate = sample_rate
         self.audio_format = audio_format
         self.timeout = timeout
+        self.min_chunk_size = min_chunk_size
         self.url = "https://openspeech.bytedance.com/api/v3/tts/unidirectional"
+        # 请求头只取决于凭证与资源，构造时生成一次
+        self.headers = {
+            "X-Api-App-Id": self.app_id,
+            "X-Api-Access-Key": self.access_key,
+            "X-Api-Resource-Id": self.resource_id,
+            "Content-Type": "application/json"
+        }
     
     async def synthesize_stream(
         self,
@@ -63,14 +93,6 @@ class DoubaoStreamingTTS:
         Yields:
             音频数据块 (bytes)
         """
-        # 设置请求头
-        headers = {
-            "X-Api-App-Id": self.app_id,
-            "X-Api-Access-Key": self.access_key,
-            "X-Api-Resource-Id": self.resource_id,
-            "Content-Type": "application/json"
-        }
-        
         # 设置请求体
         payload = {
             "user": {
@@ -89,49 +111,60 @@ class DoubaoStreamingTTS:
             }
         }
         
-        # 发送流式请求
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            async with client.stream(
-                "POST",
-                self.url,
-                headers=headers,
-                json=payload
-            ) as response:
-                
-                # 检查状态码
-                if response.status_code != 200:
-                    error_text = await response.aread()
-                    raise Exception(f"TTS请求失败 (状态码 {response.status_code}): {error_text.decode('utf-8')}")
+        # 发送流式请求（复用共享连接池，省去每次合成的 TCP + TLS 握手）
+        async with get_http_client().stream(
+            "POST",
+            self.url,
+            headers=self.headers,
+            json=payload,
+            timeout=self.timeout
+        ) as response:
+            
+            # 检查状态码
+            if response.status_code != 200:
+                error_text = await response.aread()
+                raise Exception(f"TTS请求失败 (状态码 {response.status_code}): {error_text.decode('utf-8')}")
+            
+            # 上游的音频块往往只有几十字节，先合并到缓冲区，达到 min_chunk_size 再输出
+            audio_buffer = bytearray()
+            
+            # 逐行读取响应（JSONL格式），orjson 直接解析 bytes 行
+            async for line in _aiter_jsonl(response):
+                if not line.strip():
+                    continue
                 
-                # 逐行读取响应（JSONL格式）
-                async for line in response.aiter_lines():
-                    if not line.strip():
+                try:
+                    data = orjson.loads(line)
+                    code = data.get("code", -1)
+                    
+                    # 成功且包含音频数据
+                    if code == 0 and "data" in data and data["data"]:
+                        # Base64解码音频数据
+                        audio_buffer += pybase64.b64decode(data["data"])
+                        if len(audio_buffer) >= self.min_chunk_size:
+                            # 按 16 位采样对齐输出偶数长度（前端按 Int16Array 解析 PCM），余下的字节留待下次
+                            cut = len(audio_buffer) & ~1
+                            yield bytes(audio_buffer[:cut])
+                            del audio_buffer[:cut]
                         continue
                     
-                    try:
-                        data = json.loads(line)
-                        code = data.get("code", -1)
-                        
-                        # 成功且包含音频数据
-                        if code == 0 and "data" in data and data["data"]:
-                            # Base64解码音频数据
-                            audio_chunk = base64.b64decode(data["data"])
-                            yield audio_chunk
-                            continue
-                        
-                        # 结束标记
-                        if code == 20000000:
-                            break
+                    # 结束标记
+                    if code == 20000000:
+                        break
+                    
+                    # 错误
+                    if code > 0:
+                        error_msg = data.get("message", "未知错误")
+                        raise Exception(f"TTS服务错误 (code {code}): {error_msg}")
                         
-                        # 错误
-                        if code > 0:
-                            error_msg = data.get("message", "未知错误")
-                            raise Exception(f"TTS服务错误 (code {code}): {error_msg}")
-                            
-                    except json.JSONDecodeError as e:
-                        # 忽略JSON解析错误，继续处理下一行
-                        continue
-    
+                except orjson.JSONDecodeError:
+                    # 忽略JSON解析错误，继续处理下一行
+                    continue
+            
+            # 输出剩余音频
+            if audio_buffer:
+                yield bytes(audio_buffer)
+
     async def synthesize_full(
         self,
         text: str,
@@ -0,0 +1,59 @@
+"""
+共享的 HTTP 客户端
+所有发往 UniAPI 等上游服务的请求复用同一个 httpx.AsyncClient，
+通过 HTTP/2 多路复用与连接池避免每次请求重新 TCP 连接 + TLS 握手
+"""
+import asyncio
+from typing import Optional
+
+import httpx
+
+
+# 按调用类型区分的超时配置：连接/写入/连接池等待单独设置较短的值，
+# 连接池耗尽时快速失败，而不是让所有协程都挂到读超时
+HTTP_TIMEOUTS = {
+    # 大模型生成耗时较长（含图片的多模态请求更慢），读超时放宽
+    "llm": httpx.Timeout(60.0, connect=5.0, write=10.0, pool=2.0),
+    # 语音识别需要上传完整音频文件，写超时放宽
+    "stt": httpx.Timeout(30.0, connect=5.0, write=30.0, pool=2.0),
+    "tts": httpx.Timeout(30.0, connect=5.0, write=10.0, pool=2.0),
+}
+DEFAULT_TIMEOUT = httpx.Timeout(30.0, connect=5.0, write=10.0, pool=2.0)
+
+# 多个端点同时并发访问 UniAPI，放宽连接池上限并延长空闲连接保活时间
+HTTP_LIMITS = httpx.Limits(
+    max_connections=1000,
+    max_keepalive_connections=100,
+    keepalive_expiry=30.0
+)
+
+
+_CLIENT: Optional[httpx.AsyncClient] = None
+_CLIENT_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    获取进程内共享的 httpx.AsyncClient
+
+    连接池与事件循环绑定，若事件循环发生变化或客户端已关闭则重新创建。
+    """
+    global _CLIENT, _CLIENT_LOOP
+    loop = asyncio.get_running_loop()
+    if _CLIENT is None or _CLIENT.is_closed or _CLIENT_LOOP is not loop:
+        _CLIENT = httpx.AsyncClient(
+            http2=True,
+            timeout=DEFAULT_TIMEOUT,
+            limits=HTTP_LIMITS
+        )
+        _CLIENT_LOOP = loop
+    return _CLIENT
+
+
+async def close_http_client():
+    """关闭共享客户端（应用关闭时调用）"""
+    global _CLIENT, _CLIENT_LOOP
+    if _CLIENT is not None and not _CLIENT.is_closed:
+        await _CLIENT.aclose()
+    _CLIENT = None
+    _CLIENT_LOOP = None
@@ -0,0 +1,112 @@
+"""
+上游调用限流
+突发流量下所有端点会同时打到 UniAPI，容易触发 429 或耗尽连接池。
+令牌桶限制请求速率，并发上限 + 有界等待队列限制积压，超出时立即失败（由端点返回 503），
+而不是让大量协程挂起占用连接池
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+
+class RateLimitExceeded(Exception):
+    """超出限流配置，调用方应快速失败"""
+
+
+class AsyncRateLimiter:
+    """令牌桶速率限制 + 并发上限 + 有界等待队列"""
+
+    def __init__(self, rate: float, burst: int, max_concurrency: int, max_waiting: int):
+        """
+        Args:
+            rate: 每秒补充的令牌数，<= 0 表示不限速
+            burst: 令牌桶容量（允许的瞬时突发请求数）
+            max_concurrency: 同时进行中的上游请求上限
+            max_waiting: 并发已满时允许排队等待的请求数，超出直接拒绝
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._waiting = 0
+
+    def _take_token(self):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens < 1:
+            raise RateLimitExceeded("Upstream rate limit exceeded")
+        self._tokens -= 1
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # 信号量与事件循环绑定，事件循环变化时重新创建（与共享 HTTP 客户端一致）
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+            self._waiting = 0
+        return self._semaphore
+
+    def check_capacity(self):
+        """
+        不占用名额，仅检查当前能否接受新请求，超出时抛出 RateLimitExceeded
+        流式响应一旦开始发送就无法再改为 503，需在返回响应前调用
+        """
+        semaphore = self._get_semaphore()
+        if semaphore.locked() and self._waiting >= self.max_waiting:
+            raise RateLimitExceeded("Too many pending upstream requests")
+        if self.rate > 0:
+            tokens = min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate)
+            if tokens < 1:
+                raise RateLimitExceeded("Upstream rate limit exceeded")
+
+    @asynccontextmanager
+    async def acquire(self):
+        """获取一个调用名额，超出速率或积压上限时抛出 RateLimitExceeded"""
+        semaphore = self._get_semaphore()
+        if semaphore.locked() and self._waiting >= self.max_waiting:
+            raise RateLimitExceeded("Too many pending upstream requests")
+        self._take_token()
+
+        self._waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+# UniAPI（大模型 + Whisper 语音识别）共用一个限流器，可通过环境变量调整
+UNIAPI_LIMITER = AsyncRateLimiter(
+    rate=float(os.getenv("UNIAPI_RATE_LIMIT", "10")),
+    burst=int(os.getenv("UNIAPI_RATE_BURST", "20")),
+    max_concurrency=int(os.getenv("UNIAPI_MAX_CONCURRENCY", "50")),
+    max_waiting=int(os.getenv("UNIAPI_MAX_BACKLOG", "200"))
+)
+
+# 按服务限制同时进行中的请求数（只限并发、不限速率）：并发已满时排队等待，
+# 排队数超过 max_waiting 时与 UNIAPI_LIMITER 一样抛出 RateLimitExceeded（由端点返回 503）。
+# STT 需上传整段音频、占用连接时间长，单独限制以免挤占大模型请求；豆包 TTS 是独立的上游
+STT_LIMITER = AsyncRateLimiter(
+    rate=0,
+    burst=0,
+    max_concurrency=int(os.getenv("STT_MAX_CONCURRENCY", "16")),
+    max_waiting=int(os.getenv("STT_MAX_BACKLOG", "200"))
+)
+TTS_LIMITER = AsyncRateLimiter(
+    rate=0,
+    burst=0,
+    max_concurrency=int(os.getenv("TTS_MAX_CONCURRENCY", "32")),
+    max_waiting=int(os.getenv("TTS_MAX_BACKLOG", "200"))
+)
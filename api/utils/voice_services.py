@@ -1,16 +1,74 @@
-import httpx
+import io
 import asyncio
+import hashlib
+import functools
+import httpx
 import os
-import base64
-from typing import Dict, Any, Optional, AsyncGenerator
+import pybase64
+from typing import Dict, Any, List, Optional, AsyncGenerator, BinaryIO, Union
+from .cache import LRUCache
 from .doubao_streaming_tts import DoubaoStreamingTTS
+from .http_client import get_http_client, HTTP_TIMEOUTS
+from .rate_limit import UNIAPI_LIMITER, STT_LIMITER, TTS_LIMITER, RateLimitExceeded
+
+
+# UniAPI Whisper-1 语音识别接口
+STT_URL = "https://api.uniapi.io/v1/audio/transcriptions"
+STT_MODEL = "whisper-1"
+# UniAPI 密钥（支持两种环境变量名），与 ai_client 一致在导入时读取一次
+STT_API_KEY = os.getenv('UNIAPI_KEY') or os.getenv('UNIAPI_API_KEY')
+_STT_HEADERS = {"Authorization": f"Bearer {STT_API_KEY}"}
+
+# 豆包TTS配置（使用PCM格式支持真正的流式播放）
+DOUBAO_TTS_RESOURCE_ID = "seed-tts-1.0"
+DOUBAO_TTS_SPEAKER = "zh_female_tianxinxiaomei_emo_v2_mars_bigtts"
+DOUBAO_TTS_FORMAT = "pcm"
+DOUBAO_TTS_SAMPLE_RATE = 24000
+
+# TTS 音频缓存：界面中反复播放的固定话术（如"请详细描述您的症状"）直接返回，不再请求豆包
+# TTS_CACHE_SIZE 为最大条目数（0 关闭缓存），TTS_CACHE_MAX_MB 为音频总大小上限
+_TTS_CACHE = LRUCache(
+    maxsize=int(os.getenv("TTS_CACHE_SIZE", "512")),
+    max_bytes=int(os.getenv("TTS_CACHE_MAX_MB", "64")) * 1024 * 1024
+)
+
+
+@functools.lru_cache(maxsize=4)
+def _get_tts_client(app_id: str, access_key: str) -> DoubaoStreamingTTS:
+    """按凭证复用豆包TTS客户端（使用PCM格式支持真正的流式播放），不再每次请求重新构造"""
+    return DoubaoStreamingTTS(
+        app_id=app_id,
+        access_key=access_key,
+        resource_id=DOUBAO_TTS_RESOURCE_ID,
+        speaker=DOUBAO_TTS_SPEAKER,
+        audio_format=DOUBAO_TTS_FORMAT,
+        sample_rate=DOUBAO_TTS_SAMPLE_RATE,
+        timeout=HTTP_TIMEOUTS["tts"]
+    )
+
 
-async def speech_to_text(audio_data: bytes, filename: str = "audio.webm", mime_type: str = "audio/webm", language: str = "zh") -> Dict[str, Any]:
+def _tts_cache_key(text: str) -> bytes:
+    """TTS 缓存键：音色/资源/音频参数 + 文本"""
+    raw = f"{DOUBAO_TTS_SPEAKER}|{DOUBAO_TTS_RESOURCE_ID}|{DOUBAO_TTS_FORMAT}|{DOUBAO_TTS_SAMPLE_RATE}|{text}"
+    return hashlib.sha256(raw.encode("utf-8")).digest()
+
+
+def tts_etag(text: str) -> str:
+    """TTS 音频的强 ETag：由音色/音频参数与文本唯一确定"""
+    return f'"{_tts_cache_key(text).hex()[:32]}"'
+
+
+def get_cached_speech(text: str) -> Optional[bytes]:
+    """读取已缓存的完整 TTS 音频，未命中返回 None"""
+    return _TTS_CACHE.get(_tts_cache_key(text))
+
+
+async def speech_to_text(audio_data: Union[bytes, BinaryIO], filename: str = "audio.webm", mime_type: str = "audio/webm", language: str = "zh") -> Dict[str, Any]:
     """
     语音转文字 - 统一的STT服务
     
     Args:
-        audio_data: 音频二进制数据
+        audio_data: 音频二进制数据，或可读的文件对象（httpx 会分块读取并流式上传）
         filename: 文件名
         mime_type: MIME类型
         language: 语言代码 (zh=中文, en=英文), 默认zh
@@ -19,68 +77,161 @@ async def speech_to_text(audio_data: bytes, filename: str = "audio.webm", mime_t
         {"text": "识别到的文本"}
     """
     try:
-        # 获取API密钥（支持两种环境变量名）
-        api_key = os.getenv('UNIAPI_KEY') or os.getenv('UNIAPI_API_KEY')
-        if not api_key:
+        if not STT_API_KEY:
             raise ValueError("API key not configured")
         
-        # 调用UniAPI Whisper-1进行语音识别
-        url = "https://api.uniapi.io/v1/audio/transcriptions"
+        # 以文件对象形式交给 httpx，分块流式写入 multipart 请求体
+        if isinstance(audio_data, (bytes, bytearray)):
+            audio_data = io.BytesIO(audio_data)
         
+        # 调用UniAPI Whisper-1进行语音识别
         files = {
             "file": (filename, audio_data, mime_type),
-            "model": (None, "whisper-1"),
+            "model": (None, STT_MODEL),
             "language": (None, language)
         }
         
-        headers = {
-            "Authorization": f"Bearer {api_key}"
-        }
+        async with STT_LIMITER.acquire(), UNIAPI_LIMITER.acquire():
+            response = await get_http_client().post(STT_URL, headers=_STT_HEADERS, files=files, timeout=HTTP_TIMEOUTS["stt"])
+        response.raise_for_status()
+        result = response.json()
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, headers=headers, files=files)
-            response.raise_for_status()
-            result = response.json()
-            
-            transcribed_text = result.get("text", "")
-            return {"text": transcribed_text.strip()}
-            
+        transcribed_text = result.get("text", "")
+        return {"text": transcribed_text.strip()}
+    
+    except (httpx.PoolTimeout, RateLimitExceeded):
+        # 连接池耗尽或触发限流，交给调用方返回 503
+        raise
     except Exception as e:
         raise Exception(f"Speech recognition failed: {str(e)}")
 
+class _SharedSynthesis:
+    """一次进行中的豆包合成：由后台任务写入音频块，多个请求各自从头读取（预合成与播放请求共享同一上游流）"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._cond = asyncio.Condition()
+
+    async def append(self, chunk: bytes):
+        async with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    async def finish(self, error: Optional[BaseException] = None):
+        async with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    async def iter_chunks(self) -> AsyncGenerator[bytes, None]:
+        index = 0
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: index < len(self.chunks) or self.done)
+                new_chunks = self.chunks[index:]
+                finished = self.done
+            index += len(new_chunks)
+            for chunk in new_chunks:
+                yield chunk
+            if finished and index >= len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+# 进行中的合成（按缓存键），相同文本的预合成与播放请求只打一次豆包
+_INFLIGHT_TTS: Dict[bytes, _SharedSynthesis] = {}
+# 持有后台合成任务的引用，避免任务在完成前被垃圾回收
+_SYNTHESIS_TASKS = set()
+
+
+async def _run_synthesis(text: str, cache_key: bytes, shared: _SharedSynthesis):
+    """后台执行一次合成：音频块写入共享缓冲，完成后写入缓存"""
+    error = None
+    try:
+        # 获取豆包凭证
+        app_id = os.getenv("DOUBAO_APP_ID", "9369539387")
+        access_key = os.getenv("DOUBAO_ACCESS_KEY", "EVHujvbAnGM-OW0T3WHHO1YF8ZHRzINa")
+        
+        tts_client = _get_tts_client(app_id, access_key)
+        
+        # 同时进行中的合成数受 TTS_LIMITER 限制，超出时排队等待
+        async with TTS_LIMITER.acquire():
+            async for audio_chunk in tts_client.synthesize_stream(text):
+                await shared.append(audio_chunk)
+        
+        if shared.chunks:
+            _TTS_CACHE.set(cache_key, b"".join(shared.chunks))
+    except Exception as e:
+        error = e
+    finally:
+        _INFLIGHT_TTS.pop(cache_key, None)
+        await shared.finish(error)
+
+
+def _start_synthesis(text: str, cache_key: bytes) -> _SharedSynthesis:
+    """复用进行中的合成，没有时启动新的后台合成任务"""
+    shared = _INFLIGHT_TTS.get(cache_key)
+    if shared is None:
+        shared = _SharedSynthesis()
+        _INFLIGHT_TTS[cache_key] = shared
+        task = asyncio.create_task(_run_synthesis(text, cache_key, shared))
+        _SYNTHESIS_TASKS.add(task)
+        task.add_done_callback(_SYNTHESIS_TASKS.discard)
+    return shared
+
+
+def prefetch_speech(text: str) -> None:
+    """
+    预合成语音：/api/chat/next 拿到问题后立即在后台开始合成，
+    与"响应返回前端 → 前端再发起 TTS 请求"这段往返重叠，前端请求到达时直接接上已生成的音频
+    
+    Args:
+        text: 要合成的文本（与前端随后提交给 /api/chat/tts-stream 的文本一致）
+    """
+    text = text.strip()
+    if not text or len(text) > 2000:
+        return
+    cache_key = _tts_cache_key(text)
+    if _TTS_CACHE.get(cache_key) is None:
+        _start_synthesis(text, cache_key)
+
+
+def check_speech_capacity(text: str) -> None:
+    """
+    流式合成开始前检查 TTS 并发名额：合成在后台任务中排队，若等到那时才触发限流，
+    /api/chat/tts-stream 已经返回 200，前端只会收到截断的音频。
+    已缓存或已有进行中合成的文本不会新占名额，直接通过；否则名额不足时抛出 RateLimitExceeded
+    """
+    cache_key = _tts_cache_key(text)
+    if cache_key in _INFLIGHT_TTS or _TTS_CACHE.get(cache_key) is not None:
+        return
+    TTS_LIMITER.check_capacity()
+
+
 async def text_to_speech_stream(text: str) -> AsyncGenerator[bytes, None]:
     """
     文字转语音 - 流式版本（边生成边返回）
     
     Args:
-        text: 要转换的文本
+        text: 要转换的文本（已由 TTSRequest 去除首尾空白并校验长度）
     
     Yields:
         音频数据块 (bytes)
     """
     try:
-        if not text.strip():
-            raise ValueError("Text cannot be empty")
-        
-        if len(text) > 2000:
-            raise ValueError("Text too long (max 2000 characters)")
-        
-        # 获取豆包凭证
-        app_id = os.getenv("DOUBAO_APP_ID", "9369539387")
-        access_key = os.getenv("DOUBAO_ACCESS_KEY", "EVHujvbAnGM-OW0T3WHHO1YF8ZHRzINa")
+        # 命中缓存时直接返回完整音频
+        cache_key = _tts_cache_key(text)
+        cached_audio = _TTS_CACHE.get(cache_key)
+        if cached_audio is not None:
+            yield cached_audio
+            return
         
-        # 创建豆包TTS客户端（使用PCM格式支持真正的流式播放）
-        tts_client = DoubaoStreamingTTS(
-            app_id=app_id,
-            access_key=access_key,
-            resource_id="seed-tts-1.0",
-            speaker="zh_female_tianxinxiaomei_emo_v2_mars_bigtts",
-            audio_format="pcm",
-            sample_rate=24000
-        )
-        
-        # 流式合成并返回
-        async for audio_chunk in tts_client.synthesize_stream(text.strip()):
+        # 流式返回：已有预合成时从头接上其输出，否则启动新的合成；合成成功后写入缓存
+        shared = _start_synthesis(text, cache_key)
+        async for audio_chunk in shared.iter_chunks():
             yield audio_chunk
             
     except Exception as e:
@@ -97,21 +248,6 @@ def decode_base64_audio(base64_data: str) -> bytes:
         音频二进制数据
     """
     try:
-        return base64.b64decode(base64_data)
+        return pybase64.b64decode(base64_data, validate=False)
     except Exception as e:
         raise Exception(f"Failed to decode base64 audio: {str(e)}")
-
-def encode_audio_to_base64(audio_data: bytes) -> str:
-    """
-    将音频数据编码为base64
-    
-    Args:
-        audio_data: 音频二进制数据
-    
-    Returns:
-        base64编码的字符串
-    """
-    try:
-        return base64.b64encode(audio_data).decode('utf-8')
-    except Exception as e:
-        raise Exception(f"Failed to encode audio to base64: {str(e)}")
@@ -1,14 +1,21 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
 import os
+import sys
+import logging
 import uvicorn
 from dotenv import load_dotenv
 
 # 加载环境变量
 load_dotenv()
 
+# 日志级别默认 WARNING，调试时可设置 LOG_LEVEL=DEBUG 查看逐帧日志
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "WARNING").upper(),
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s"
+)
+
 # 导入 Vercel 使用的 FastAPI 应用
 from api.index import app as vercel_app
 
@@ -31,4 +38,20 @@ app.mount("/static", StaticFiles(directory=BASE_DIR, html=False), name="static")
 
 
 if __name__ == "__main__":
-    uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=True)
+    # ENV=dev（默认）：单进程 + 代码热重载，方便本地开发；
+    # 其他值（如 ENV=prod）：关闭热重载，按 WEB_CONCURRENCY 启动多个 worker 进程
+    # （各 worker 的缓存与限流器相互独立）
+    is_dev = os.getenv("ENV", "dev") == "dev"
+    
+    # 事件循环使用 uvloop（libuv 实现，Windows 不支持时退回 asyncio），
+    # HTTP 解析使用 httptools（C 实现，比默认的纯 Python h11 更快），WebSocket 使用 websockets
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=is_dev,
+        workers=1 if is_dev else int(os.getenv("WEB_CONCURRENCY", "4")),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        ws="websockets"
+    )